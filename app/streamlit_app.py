@@ -4,15 +4,35 @@
 import streamlit as st
 import os
 import sys
-import yaml
+import ahocorasick
+import numpy as np
+from collections import deque
 from datetime import datetime
-import plotly.express as px
-import plotly.graph_objects as go
-import pandas as pd
 
 # 프로젝트 루트 경로 추가
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# API 장애 시 키워드 기반 대체 답변
+MOCK_ANSWERS = {
+    "예약": "예약은 전화(02-1234-5678) 또는 온라인(www.hospital.com)으로 가능합니다.",
+    "취소": "예약 취소는 진료 24시간 전까지 가능합니다. 전화 또는 온라인으로 취소해주세요.",
+    "진료시간": "평일 오전 9시부터 오후 6시까지, 토요일 오전 9시부터 오후 1시까지 진료합니다.",
+    "응급실": "응급실은 24시간 운영됩니다. 응급상황 시 119에 신고하세요.",
+    "밀크시슬": "밀크시슬(Milk Thistle)은 간 건강에 도움을 주는 천연 보조제입니다. 간 기능 개선과 해독 작용에 도움이 됩니다. 처방전 없이 구입 가능하지만, 복용 전 의사와 상담하시기 바랍니다."
+}
+
+# 키워드 매칭용 Aho-Corasick 오토마톤 (질문 길이에 비례하는 단일 스캔)
+_MOCK_AUTOMATON = ahocorasick.Automaton()
+for _key in MOCK_ANSWERS:
+    _MOCK_AUTOMATON.add_word(_key, _key)
+_MOCK_AUTOMATON.make_automaton()
+
+# 세션별 보관할 최대 대화 수 (재실행 시 렌더링/직렬화 비용 제한)
+MAX_CHAT_HISTORY = 200
+
+# 신뢰도 분포 차트 구간 수
+CONFIDENCE_BINS = 10
+
 # 페이지 설정
 st.set_page_config(
     page_title="🏥 병원 고객 질의응답 RAG 챗봇",
@@ -47,10 +67,22 @@ with st.sidebar:
     
     # 통계 정보
     st.subheader("📈 사용 통계")
-    if 'chat_history' in st.session_state:
-        st.metric("총 질문 수", len(st.session_state.chat_history))
-    else:
-        st.metric("총 질문 수", 0)
+    st.metric("총 질문 수", st.session_state.get('total_questions', 0))
+
+# OpenAI 클라이언트 (프로세스 내 공유, HTTP/2 연결 재사용)
+@st.cache_resource
+def _get_openai_client():
+    """재실행/세션 간 공유되는 OpenAI 클라이언트"""
+    import httpx
+    import openai
+    
+    return openai.OpenAI(
+        api_key=os.getenv('OPENAI_API_KEY'),
+        http_client=httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20)
+        )
+    )
 
 # 완전한 RAG 시스템 (OpenAI 기반)
 class FullRAGSystem:
@@ -60,64 +92,101 @@ class FullRAGSystem:
         self.openai_key = os.getenv('OPENAI_API_KEY')
         if not self.openai_key:
             st.error("OpenAI API 키가 설정되지 않았습니다.")
+        
+        # 동일/유사 질문 응답 캐시 (get_rag_system 캐시로 재실행 간 유지)
+        # faiss 로딩이 첫 화면을 늦추지 않도록 시스템 생성 시점에 import
+        from src.semantic_cache import SemanticCache
+        self.cache = SemanticCache(self._embed)
+    
+    def _embed(self, text: str):
+        """OpenAI 임베딩 생성"""
+        client = _get_openai_client()
+        response = client.embeddings.create(
+            model="text-embedding-3-small",
+            input=text,
+            dimensions=512
+        )
+        return response.data[0].embedding
+    
+    def _stream_answer(self, stream, result: dict, embedding):
+        """스트리밍 응답 토큰 전달 후 완성된 답변을 캐시에 저장"""
+        tokens = []
+        try:
+            for chunk in stream:
+                token = chunk.choices[0].delta.content or ""
+                tokens.append(token)
+                yield token
+        except Exception:
+            # 스트림 도중 연결 끊김/타임아웃: 대체 답변으로 마무리하고 부분 답변은 캐시하지 않음
+            answer, result['confidence'] = self._fallback_answer(result['question'])
+            yield f"\n\n⚠️ 답변 생성이 중단되었습니다. {answer}"
+            return
+        
+        # 캐시 조회가 실패한 경우(embedding 없음) 저장 생략
+        if embedding is None:
+            return
+        
+        self.cache.add(result['question'], {
+            'answer': "".join(tokens),
+            'source_documents': [],
+            'confidence': result['confidence']
+        }, embedding)
+    
+    def _fallback_answer(self, question: str):
+        """OpenAI API 실패시 Mock 답변 (질문에 처음 등장하는 키워드 기준)"""
+        for _, key in _MOCK_AUTOMATON.iter(question):
+            return MOCK_ANSWERS[key], 0.8
+        
+        return "죄송합니다. 해당 질문에 대한 답변을 찾을 수 없습니다. 전화(02-1234-5678)로 문의해주세요.", 0.3
     
     def query(self, question: str):
-        """OpenAI GPT-4를 사용한 질의응답"""
+        """OpenAI GPT-4를 사용한 질의응답
+
+        캐시 미적중 시 'answer'는 문자열이 아닌 토큰 제너레이터입니다.
+        """
+        # 캐시 조회 (임베딩 API 실패 시 캐시 없이 LLM 호출)
         try:
-            import openai
-            
-            # OpenAI 클라이언트 초기화
-            client = openai.OpenAI(api_key=self.openai_key)
+            cached = self.cache.lookup(question)
+        except Exception:
+            cached = {'result': None, 'embedding': None}
+        
+        if cached['result'] is not None:
+            return cached['result']
+        
+        try:
+            # 공유 OpenAI 클라이언트 (매 요청 TLS 핸드셰이크 생략)
+            client = _get_openai_client()
             
             # 병원 관련 컨텍스트 프롬프트
             system_prompt = """당신은 병원 고객 상담 전문가입니다. 
             다음 질문에 대해 전문적이고 친절한 답변을 제공해주세요.
             답변은 한국어로 작성하고, 구체적이고 실용적인 정보를 포함해주세요."""
             
-            # GPT-4 API 호출
-            response = client.chat.completions.create(
+            # GPT-4 API 호출 (스트리밍)
+            stream = client.chat.completions.create(
                 model="gpt-4o",
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": question}
                 ],
                 max_tokens=500,
-                temperature=0.1
+                temperature=0.1,
+                stream=True
             )
             
-            answer = response.choices[0].message.content
-            confidence = 0.9  # GPT-4는 높은 신뢰도
-            
-            return {
-                'answer': answer,
+            result = {
+                'answer': None,
                 'source_documents': [],
-                'confidence': confidence,
+                'confidence': 0.9,  # GPT-4는 높은 신뢰도
                 'question': question
             }
             
-        except Exception as e:
-            # OpenAI API 실패시 Mock 답변
-            mock_answers = {
-                "예약": "예약은 전화(02-1234-5678) 또는 온라인(www.hospital.com)으로 가능합니다.",
-                "취소": "예약 취소는 진료 24시간 전까지 가능합니다. 전화 또는 온라인으로 취소해주세요.",
-                "진료시간": "평일 오전 9시부터 오후 6시까지, 토요일 오전 9시부터 오후 1시까지 진료합니다.",
-                "응급실": "응급실은 24시간 운영됩니다. 응급상황 시 119에 신고하세요.",
-                "밀크시슬": "밀크시슬(Milk Thistle)은 간 건강에 도움을 주는 천연 보조제입니다. 간 기능 개선과 해독 작용에 도움이 됩니다. 처방전 없이 구입 가능하지만, 복용 전 의사와 상담하시기 바랍니다."
-            }
-            
-            # 키워드 매칭
-            matched_key = None
-            for key in mock_answers.keys():
-                if key in question:
-                    matched_key = key
-                    break
+            # 'answer'는 토큰 제너레이터이며, 스트림이 끝나면 캐시에 저장
+            result['answer'] = self._stream_answer(stream, result, cached['embedding'])
+            return result
             
-            if matched_key:
-                answer = mock_answers[matched_key]
-                confidence = 0.8
-            else:
-                answer = "죄송합니다. 해당 질문에 대한 답변을 찾을 수 없습니다. 전화(02-1234-5678)로 문의해주세요."
-                confidence = 0.3
+        except Exception as e:
+            answer, confidence = self._fallback_answer(question)
             
             return {
                 'answer': answer,
@@ -135,12 +204,25 @@ def get_rag_system():
 # 메인 컨텐츠
 col1, col2 = st.columns([2, 1])
 
+with col2:
+    st.header("📊 답변 결과")
+    
+    # 스트리밍 답변을 바로 표시할 "💡 답변" 영역
+    answer_panel = st.container()
+
+# 이번 실행에서 답변을 스트리밍으로 표시했는지 여부
+streamed = False
+
 with col1:
     st.header("💬 질의응답")
     
-    # 채팅 히스토리 초기화
+    # 채팅 히스토리 초기화 (최근 MAX_CHAT_HISTORY개만 보관, 통계는 누적 합계로 유지)
     if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = []
+        st.session_state.chat_history = deque(maxlen=MAX_CHAT_HISTORY)
+        st.session_state.total_questions = 0
+        st.session_state.sum_conf = 0.0
+        st.session_state.sum_sources = 0
+        st.session_state.hist_bins = np.zeros(CONFIDENCE_BINS, dtype=np.int32)
     
     # 질문 입력
     user_question = st.text_area(
@@ -166,29 +248,43 @@ with col1:
                 
                 # 질의 처리
                 result = st.session_state.rag_system.query(user_question)
-                
-                # 결과를 채팅 히스토리에 추가
-                st.session_state.chat_history.append({
-                    'timestamp': datetime.now(),
-                    'question': user_question,
-                    'answer': result['answer'],
-                    'confidence': result['confidence'],
-                    'sources': result['source_documents']
-                })
-                
-                st.success("✅ 답변 생성 완료!")
+            
+            # 스트리밍 응답은 토큰이 도착하는 대로 답변 영역에 표시
+            answer = result['answer']
+            if not isinstance(answer, str):
+                streamed = True
+                with answer_panel:
+                    st.subheader("💡 답변")
+                    answer = st.write_stream(answer)
+            
+            # 누적 통계 갱신
+            st.session_state.total_questions += 1
+            st.session_state.sum_conf += result['confidence']
+            st.session_state.sum_sources += len(result['source_documents'])
+            st.session_state.hist_bins[min(int(result['confidence'] * CONFIDENCE_BINS), CONFIDENCE_BINS - 1)] += 1
+            
+            # 결과를 채팅 히스토리에 추가
+            st.session_state.chat_history.append({
+                'timestamp': datetime.now(),
+                'question': user_question,
+                'answer': answer,
+                'confidence': result['confidence'],
+                'sources': result['source_documents']
+            })
+            
+            st.success("✅ 답변 생성 완료!")
         else:
             st.warning("⚠️ 질문을 입력해주세요.")
 
 with col2:
-    st.header("📊 답변 결과")
-    
     if st.session_state.chat_history:
         latest_result = st.session_state.chat_history[-1]
         
-        # 답변 표시
-        st.subheader("💡 답변")
-        st.write(latest_result['answer'])
+        # 답변 표시 (이번 실행에서 스트리밍으로 이미 표시한 경우 생략)
+        if not streamed:
+            with answer_panel:
+                st.subheader("💡 답변")
+                st.write(latest_result['answer'])
         
         # 신뢰도 표시
         if show_confidence:
@@ -212,19 +308,16 @@ if st.session_state.chat_history:
     
     # 히스토리 표시
     for i, chat in enumerate(reversed(st.session_state.chat_history)):
-        with st.expander(f"질문 {len(st.session_state.chat_history)-i}: {chat['question'][:50]}..."):
-            col_q, col_a = st.columns([1, 2])
-            
-            with col_q:
-                st.write("**질문:**")
-                st.write(chat['question'])
-                st.caption(f"시간: {chat['timestamp'].strftime('%H:%M:%S')}")
-            
-            with col_a:
-                st.write("**답변:**")
-                st.write(chat['answer'])
-                if show_confidence:
-                    st.caption(f"신뢰도: {chat['confidence']:.1%}")
+        with st.expander(f"질문 {st.session_state.total_questions-i}: {chat['question'][:50]}..."):
+            # 항목당 한 번의 markdown 호출로 렌더링 (프론트엔드 전송 횟수 최소화)
+            body = (
+                f"**질문:**\n\n{chat['question']}\n\n"
+                f"*시간: {chat['timestamp']:%H:%M:%S}*\n\n"
+                f"**답변:**\n\n{chat['answer']}"
+            )
+            if show_confidence:
+                body += f"\n\n*신뢰도: {chat['confidence']:.1%}*"
+            st.markdown(body)
 
 # 통계 및 분석
 if len(st.session_state.chat_history) > 0:
@@ -234,26 +327,28 @@ if len(st.session_state.chat_history) > 0:
     col_stat1, col_stat2, col_stat3 = st.columns(3)
     
     with col_stat1:
-        st.metric("총 질문 수", len(st.session_state.chat_history))
+        st.metric("총 질문 수", st.session_state.total_questions)
     
     with col_stat2:
-        avg_confidence = sum(chat['confidence'] for chat in st.session_state.chat_history) / len(st.session_state.chat_history)
+        avg_confidence = st.session_state.sum_conf / st.session_state.total_questions
         st.metric("평균 신뢰도", f"{avg_confidence:.1%}")
     
     with col_stat3:
-        total_sources = sum(len(chat['sources']) for chat in st.session_state.chat_history)
-        st.metric("총 참조 문서", total_sources)
+        st.metric("총 참조 문서", st.session_state.sum_sources)
     
     # 신뢰도 분포 차트
-    if len(st.session_state.chat_history) > 1:
-        confidence_data = [chat['confidence'] for chat in st.session_state.chat_history]
+    if st.session_state.total_questions > 1:
+        # 차트가 필요할 때만 plotly 로드 (첫 화면 로딩 시간 단축)
+        import plotly.graph_objects as go
         
-        fig = px.histogram(
-            x=confidence_data,
-            nbins=10,
-            title="신뢰도 분포",
-            labels={'x': '신뢰도', 'y': '빈도'}
-        )
+        # 답변마다 누적한 구간별 빈도로 바로 렌더링 (히스토리 재집계 없음)
+        bin_width = 1 / CONFIDENCE_BINS
+        fig = go.Figure(go.Bar(
+            x=np.linspace(bin_width / 2, 1 - bin_width / 2, CONFIDENCE_BINS),
+            y=st.session_state.hist_bins,
+            width=bin_width
+        ))
+        fig.update_layout(title="신뢰도 분포", xaxis_title="신뢰도", yaxis_title="빈도")
         st.plotly_chart(fig, use_container_width=True)
 
 # 푸터
@@ -7,6 +7,33 @@ from typing import List, Dict, Tuple
 import re
 import yaml
 import os
+import streamlit as st
+
+# 특수문자 정리 (의료 용어 보존)
+_NON_KOREAN = re.compile(r'[^\w\s가-힣.,!?]')
+# 연속 공백
+_WHITESPACE = re.compile(r'\s+')
+
+@st.cache_data(ttl=3600)
+def load_data(train_path: str, validation_path: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """CSV 데이터 로드 (Streamlit 재실행 간 캐시)"""
+    train_data = pd.read_csv(train_path, encoding='utf-8')
+    val_data = pd.read_csv(validation_path, encoding='utf-8')
+    
+    return train_data, val_data
+
+@st.cache_data(ttl=3600)
+def analyze_data_quality(df: pd.DataFrame) -> Dict:
+    """데이터 품질 분석 (동일 DataFrame은 캐시 재사용)"""
+    return {
+        'total_samples': len(df),
+        'missing_questions': df['질문'].isna().sum(),
+        'missing_answers': df['답변'].isna().sum(),
+        'avg_question_length': df['질문'].str.len().mean(),
+        'avg_answer_length': df['답변'].str.len().mean(),
+        'unique_questions': df['질문'].nunique(),
+        'duplicate_questions': df['질문'].duplicated().sum()
+    }
 
 class HospitalDataProcessor:
     """병원 데이터 전처리 클래스"""
@@ -19,8 +46,7 @@ class HospitalDataProcessor:
     def load_data(self, train_path: str, validation_path: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
         """데이터 로드"""
         try:
-            train_data = pd.read_csv(train_path, encoding='utf-8')
-            val_data = pd.read_csv(validation_path, encoding='utf-8')
+            train_data, val_data = load_data(train_path, validation_path)
             
             print(f"✅ 훈련 데이터 로드 완료: {len(train_data)}개 샘플")
             print(f"✅ 검증 데이터 로드 완료: {len(val_data)}개 샘플")
@@ -32,64 +58,55 @@ class HospitalDataProcessor:
     
     def preprocess_text(self, text: str) -> str:
         """텍스트 전처리"""
-        if pd.isna(text):
+        # None / NaN / pd.NA 처리 (문자열은 pd.isna 호출 생략)
+        if not isinstance(text, str) and pd.isna(text):
             return ""
         
-        # 기본 정리
-        text = str(text).strip()
-        
-        # 특수문자 정리 (의료 용어 보존)
-        text = re.sub(r'[^\w\s가-힣.,!?]', '', text)
-        
-        # 연속 공백 제거
-        text = re.sub(r'\s+', ' ', text)
-        
-        return text
+        # 기본 정리, 특수문자 정리, 연속 공백 제거
+        return _WHITESPACE.sub(' ', _NON_KOREAN.sub('', str(text).strip()))
+    
+    def preprocess_column(self, series: pd.Series) -> pd.Series:
+        """텍스트 컬럼 일괄 전처리 (preprocess_text의 벡터화 버전)"""
+        return (
+            series.fillna('')
+            .astype(str)
+            .str.strip()
+            .str.replace(_NON_KOREAN, '', regex=True)
+            .str.replace(_WHITESPACE, ' ', regex=True)
+        )
     
     def create_qa_pairs(self, df: pd.DataFrame) -> List[Dict]:
         """Q&A 쌍 생성"""
-        qa_pairs = []
+        empty = pd.Series('', index=df.index)
+        questions = self.preprocess_column(df.get('질문', empty))
+        answers = self.preprocess_column(df.get('답변', empty))
         
-        for idx, row in df.iterrows():
-            question = self.preprocess_text(row.get('질문', ''))
-            answer = self.preprocess_text(row.get('답변', ''))
-            
-            if question and answer:
-                qa_pairs.append({
-                    'id': idx,
-                    'question': question,
-                    'answer': answer,
-                    'category': 'hospital',
-                    'metadata': {
-                        'source': 'hospital_qa',
-                        'index': idx
-                    }
-                })
+        mask = questions.ne('') & answers.ne('')
         
-        return qa_pairs
+        return [
+            {
+                'id': idx,
+                'question': question,
+                'answer': answer,
+                'category': 'hospital',
+                'metadata': {
+                    'source': 'hospital_qa',
+                    'index': idx
+                }
+            }
+            for idx, question, answer in zip(df.index[mask], questions[mask], answers[mask])
+        ]
     
     def analyze_data_quality(self, df: pd.DataFrame) -> Dict:
         """데이터 품질 분석"""
-        analysis = {
-            'total_samples': len(df),
-            'missing_questions': df['질문'].isna().sum(),
-            'missing_answers': df['답변'].isna().sum(),
-            'avg_question_length': df['질문'].str.len().mean(),
-            'avg_answer_length': df['답변'].str.len().mean(),
-            'unique_questions': df['질문'].nunique(),
-            'duplicate_questions': df['질문'].duplicated().sum()
-        }
-        
-        return analysis
+        return analyze_data_quality(df)
     
     def save_processed_data(self, qa_pairs: List[Dict], output_path: str):
-        """전처리된 데이터 저장"""
-        import pickle
-        
+        """전처리된 데이터 저장 (Parquet)"""
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         
-        with open(output_path, 'wb') as f:
-            pickle.dump(qa_pairs, f)
+        df = pd.DataFrame(qa_pairs)
+        df.to_parquet(output_path, engine='pyarrow', compression='zstd', index=False)
         
         print(f"✅ 전처리된 데이터 저장 완료: {output_path}")
 
@@ -115,8 +132,8 @@ def main():
         val_qa_pairs = processor.create_qa_pairs(val_data)
         
         # 전처리된 데이터 저장
-        processor.save_processed_data(train_qa_pairs, "data/processed/train_qa_pairs.pkl")
-        processor.save_processed_data(val_qa_pairs, "data/processed/val_qa_pairs.pkl")
+        processor.save_processed_data(train_qa_pairs, "data/processed/train_qa_pairs.parquet")
+        processor.save_processed_data(val_qa_pairs, "data/processed/val_qa_pairs.parquet")
         
         print(f"✅ 전처리 완료: {len(train_qa_pairs)}개 훈련 샘플, {len(val_qa_pairs)}개 검증 샘플")
 
@@ -2,16 +2,27 @@
 병원 고객 질의응답 RAG 시스템
 """
 import os
+import asyncio
+import concurrent.futures
+import hashlib
+import json
 import pickle
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_community.vectorstores import FAISS
 from langchain.chains import RetrievalQA
-from langchain_openai import OpenAI
 from langchain.schema import Document
+from langchain.globals import set_llm_cache
+from langchain_community.cache import SQLiteCache
+import faiss
+import numpy as np
+import pandas as pd
 import yaml
 import streamlit as st
+from src.semantic_cache import SemanticCache
 
 class HospitalRAGSystem:
     """병원 RAG 시스템 클래스"""
@@ -25,13 +36,26 @@ class HospitalRAGSystem:
         self.vectorstore = None
         self.retriever = None
         self.qa_chain = None
+        self.cache = None
         
     def setup_embeddings(self):
         """임베딩 모델 설정"""
         try:
             # OpenAI 임베딩 사용
-            self.embeddings = OpenAIEmbeddings(
-                openai_api_key=os.getenv('OPENAI_API_KEY')
+            model_config = self.config['model']
+            underlying_embeddings = OpenAIEmbeddings(
+                openai_api_key=os.getenv('OPENAI_API_KEY'),
+                model=model_config['openai_embedding_model'],
+                dimensions=model_config['embedding_dimensions'],
+                chunk_size=self.config['vectorstore']['embedding_batch_size']
+            )
+            
+            # 텍스트 해시 기반 임베딩 캐시 (변경되지 않은 청크는 재임베딩 생략)
+            # 차원이 다른 벡터가 섞이지 않도록 모델명과 차원으로 구분
+            self.embeddings = CacheBackedEmbeddings.from_bytes_store(
+                underlying_embeddings,
+                LocalFileStore(self.config['cache']['embedding_cache_path']),
+                namespace=f"{underlying_embeddings.model}-{underlying_embeddings.dimensions}"
             )
             print("✅ OpenAI 임베딩 모델 설정 완료")
         except Exception as e:
@@ -41,57 +65,125 @@ class HospitalRAGSystem:
             self.embeddings = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
             print("✅ SentenceTransformer 임베딩 모델 설정 완료")
     
-    def load_qa_data(self, data_path: str) -> List[Dict]:
-        """Q&A 데이터 로드"""
+    def setup_cache(self):
+        """응답 캐시 설정"""
+        cache_config = self.config['cache']
+        
+        # LLM 프롬프트 완전 일치 캐시
+        set_llm_cache(SQLiteCache(database_path=cache_config['llm_cache_path']))
+        
+        # 유사 질문 캐시 (SentenceTransformer 대체 모델은 embed_query 대신 encode 사용)
+        embed_fn = getattr(self.embeddings, 'embed_query', None) or self.embeddings.encode
+        self.cache = SemanticCache(
+            embed_fn,
+            threshold=cache_config['similarity_threshold']
+        )
+        print("✅ 응답 캐시 설정 완료")
+    
+    def load_qa_data(self, data_path: str) -> pd.DataFrame:
+        """Q&A 데이터 로드 (Parquet)"""
         try:
-            with open(data_path, 'rb') as f:
-                qa_pairs = pickle.load(f)
+            qa_pairs = pd.read_parquet(data_path, engine='pyarrow')
             print(f"✅ Q&A 데이터 로드 완료: {len(qa_pairs)}개 샘플")
             return qa_pairs
         except Exception as e:
             print(f"❌ 데이터 로드 실패: {e}")
-            return []
+            return pd.DataFrame()
     
-    def create_documents(self, qa_pairs: List[Dict]) -> List[Document]:
-        """Document 객체 생성"""
+    def create_documents(self, qa_pairs: pd.DataFrame) -> List[Document]:
+        """Document 객체 생성 (동일 질문은 하나의 Document로 병합)"""
+        unique_qa: Dict[str, Dict] = {}
+        
+        # 행 단위 dict 변환 없이 컬럼을 직접 순회
+        for qa_id, question, answer, category, metadata in zip(
+            qa_pairs['id'], qa_pairs['question'], qa_pairs['answer'],
+            qa_pairs['category'], qa_pairs['metadata']
+        ):
+            qa = unique_qa.get(question)
+            if qa is None:
+                unique_qa[question] = {
+                    'id': qa_id,
+                    'answers': [answer],
+                    'category': category,
+                    'metadata': metadata
+                }
+            elif answer not in qa['answers']:
+                # 중복 질문의 서로 다른 답변은 목록으로 보관
+                qa['answers'].append(answer)
+        
         documents = []
         
-        for qa in qa_pairs:
+        for question, qa in unique_qa.items():
             # 질문과 답변을 결합한 텍스트 생성
-            content = f"질문: {qa['question']}\n답변: {qa['answer']}"
+            answer_text = "\n".join(qa['answers'])
+            content = f"질문: {question}\n답변: {answer_text}"
             
             doc = Document(
                 page_content=content,
                 metadata={
                     'id': qa['id'],
-                    'question': qa['question'],
-                    'answer': qa['answer'],
+                    'question': question,
+                    'answer': qa['answers'][0],
+                    'answers': qa['answers'],
                     'category': qa['category'],
                     **qa['metadata']
                 }
             )
             documents.append(doc)
         
+        print(f"✅ 중복 질문 병합 완료: {len(qa_pairs)}개 → {len(documents)}개 문서")
+        
         return documents
     
     def setup_vectorstore(self, documents: List[Document]):
         """벡터 저장소 설정"""
         try:
-            # 텍스트 분할
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=self.config['model']['chunk_size'],
-                chunk_overlap=self.config['model']['chunk_overlap']
-            )
+            vectorstore_path = self.config['data']['vectorstore_path']
+            manifest = self._vectorstore_manifest(documents)
+            saved_manifest = self._load_current_manifest(vectorstore_path, manifest)
             
-            splits = text_splitter.split_documents(documents)
-            print(f"✅ 문서 분할 완료: {len(splits)}개 청크")
+            if saved_manifest is not None:
+                # 저장된 인덱스 재사용
+                self.vectorstore = self._load_vectorstore(
+                    vectorstore_path,
+                    saved_manifest.get('ivf_index', False)
+                )
+                print("✅ 저장된 벡터 저장소 로드 완료")
+            else:
+                # 텍스트 분할 (chunk_size 이하의 짧은 문서는 분할 생략)
+                chunk_size = self.config['model']['chunk_size']
+                text_splitter = RecursiveCharacterTextSplitter(
+                    chunk_size=chunk_size,
+                    chunk_overlap=self.config['model']['chunk_overlap']
+                )
+                
+                short_docs = [doc for doc in documents if len(doc.page_content) <= chunk_size]
+                long_docs = [doc for doc in documents if len(doc.page_content) > chunk_size]
+                splits = short_docs + text_splitter.split_documents(long_docs)
+                print(f"✅ 문서 분할 완료: {len(splits)}개 청크")
+                
+                # 임베딩 병렬 생성
+                texts = [doc.page_content for doc in splits]
+                vectors = self._run_coroutine(self._aembed_documents(texts))
+                print(f"✅ 임베딩 생성 완료: {len(vectors)}개 벡터")
+                
+                # 벡터 저장소 생성 후 ANN 인덱스로 교체
+                self.vectorstore = FAISS.from_embeddings(
+                    list(zip(texts, vectors)),
+                    self.embeddings,
+                    metadatas=[doc.metadata for doc in splits]
+                )
+                self.vectorstore.index = self._build_ann_index(self.vectorstore.index)
+                self.vectorstore.save_local(vectorstore_path)
+                
+                # 다음 실행에서 재사용 여부와 로드 방식을 판단할 빌드 정보 저장
+                # (ivfpq 설정이어도 HNSW로 대체될 수 있어 실제 인덱스 종류를 함께 기록)
+                manifest['ivf_index'] = isinstance(self.vectorstore.index, faiss.IndexIVF)
+                with open(os.path.join(vectorstore_path, "manifest.json"), 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f, ensure_ascii=False, indent=2)
             
-            # 벡터 저장소 생성
-            self.vectorstore = Chroma.from_documents(
-                documents=splits,
-                embedding=self.embeddings,
-                persist_directory=self.config['data']['vectorstore_path']
-            )
+            # 검색 파라미터 설정 (저장 파일과 무관하게 설정값 적용)
+            self._set_search_params(self.vectorstore.index)
             
             # 검색기 설정
             self.retriever = self.vectorstore.as_retriever(
@@ -103,14 +195,182 @@ class HospitalRAGSystem:
         except Exception as e:
             print(f"❌ 벡터 저장소 설정 실패: {e}")
     
+    def _vectorstore_manifest(self, documents: List[Document]) -> Dict[str, Any]:
+        """벡터 저장소 빌드 정보 (설정/데이터가 바뀌면 달라짐)"""
+        model_config = self.config['model']
+        vs_config = self.config['vectorstore']
+        
+        # 임베딩 대상 문서 내용 해시
+        digest = hashlib.blake2b(digest_size=16)
+        for doc in documents:
+            digest.update(doc.page_content.encode('utf-8'))
+            digest.update(b'\0')
+        
+        return {
+            'embedding_model': model_config['openai_embedding_model'],
+            'embedding_dimensions': model_config['embedding_dimensions'],
+            'index_type': vs_config['index_type'],
+            'hnsw_m': vs_config['hnsw_m'],
+            'hnsw_ef_construction': vs_config['hnsw_ef_construction'],
+            'ivf_nlist': vs_config['ivf_nlist'],
+            'pq_m': vs_config['pq_m'],
+            'ivfpq_min_recall': vs_config['ivfpq_min_recall'],
+            'chunk_size': model_config['chunk_size'],
+            'chunk_overlap': model_config['chunk_overlap'],
+            'documents_hash': digest.hexdigest()
+        }
+    
+    def _load_current_manifest(self, vectorstore_path: str, manifest: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """저장된 인덱스가 현재 설정/데이터로 만든 것이면 저장된 빌드 정보 반환"""
+        manifest_path = os.path.join(vectorstore_path, "manifest.json")
+        if not os.path.exists(os.path.join(vectorstore_path, "index.faiss")):
+            return None
+        
+        if not os.path.exists(manifest_path):
+            print("⚠️ 빌드 정보가 없는 벡터 저장소입니다. 인덱스를 다시 생성합니다.")
+            return None
+        
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            saved_manifest = json.load(f)
+        
+        changed = [key for key in manifest if saved_manifest.get(key) != manifest[key]]
+        if changed:
+            print(f"⚠️ 벡터 저장소 설정/데이터 변경({', '.join(changed)}). 인덱스를 다시 생성합니다.")
+            return None
+        
+        return saved_manifest
+    
+    def _load_vectorstore(self, vectorstore_path: str, ivf_index: bool) -> FAISS:
+        """저장된 벡터 저장소 로드 (IVF 인덱스는 메모리 매핑)"""
+        # IO_FLAG_MMAP은 IVF 역색인 리스트에만 적용되므로 HNSW 등은 일반 로드
+        if not ivf_index:
+            return FAISS.load_local(
+                vectorstore_path,
+                self.embeddings,
+                allow_dangerous_deserialization=True
+            )
+        
+        # IVF는 한 번만 매핑해 필요한 페이지만 읽고, 같은 파일을 여는 프로세스 간 메모리 공유
+        index = faiss.read_index(
+            os.path.join(vectorstore_path, "index.faiss"),
+            faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        )
+        
+        # FAISS.save_local()이 저장한 문서 저장소와 인덱스-문서 ID 매핑
+        with open(os.path.join(vectorstore_path, "index.pkl"), 'rb') as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        
+        return FAISS(self.embeddings, index, docstore, index_to_docstore_id)
+    
+    def _run_coroutine(self, coro):
+        """실행 중인 이벤트 루프 여부와 관계없이 코루틴을 동기 실행"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coro)
+        
+        # 비동기 코드(배치 평가 등) 안에서 호출된 경우 별도 스레드의 새 루프에서 실행
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coro).result()
+    
+    async def _aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """배치 단위 임베딩을 동시 요청으로 생성"""
+        vs_config = self.config['vectorstore']
+        batch_size = vs_config['embedding_batch_size']
+        semaphore = asyncio.Semaphore(vs_config['embedding_concurrency'])
+        
+        async def embed_batch(batch: List[str]) -> List[List[float]]:
+            # 동시 요청 수 제한 (OpenAI RPM/TPM 한도 고려)
+            async with semaphore:
+                return await self.embeddings.aembed_documents(batch)
+        
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        results = await asyncio.gather(*[embed_batch(batch) for batch in batches])
+        
+        return [vector for batch_vectors in results for vector in batch_vectors]
+    
+    def _build_ann_index(self, flat_index) -> faiss.Index:
+        """설정된 종류(hnsw / ivfpq)의 ANN 인덱스 생성"""
+        vs_config = self.config['vectorstore']
+        
+        if vs_config['index_type'] == 'ivfpq':
+            # IVF 클러스터와 8비트 PQ 코드북(256개 중심점) 모두 학습 데이터가 충분해야 함
+            min_train = max(vs_config['ivf_nlist'], 256) * 39
+            if flat_index.ntotal < min_train:
+                print(f"⚠️ 벡터 수({flat_index.ntotal})가 {min_train}개 미만이라 IVF-PQ 대신 HNSW 인덱스 사용")
+                return self._build_hnsw_index(flat_index)
+            
+            index = self._build_ivfpq_index(flat_index)
+            
+            # 양자화로 인한 검색 품질 저하 확인
+            recall = self._measure_recall(index, flat_index)
+            print(f"📏 IVF-PQ recall@{self.config['rag']['top_k']}: {recall:.3f}")
+            if recall >= vs_config['ivfpq_min_recall']:
+                return index
+            print(f"⚠️ IVF-PQ recall이 {vs_config['ivfpq_min_recall']} 미만이라 HNSW 인덱스 사용")
+        
+        return self._build_hnsw_index(flat_index)
+    
+    def _build_ivfpq_index(self, flat_index) -> faiss.Index:
+        """Flat 인덱스의 벡터로 IVF-PQ 인덱스 생성 (Product Quantization)"""
+        vs_config = self.config['vectorstore']
+        
+        vectors = flat_index.reconstruct_n(0, flat_index.ntotal)
+        # LangChain FAISS 저장소가 L2 거리를 가정하므로 L2 사용 (정규화 임베딩에서는 내적과 순위 동일)
+        index = faiss.index_factory(
+            flat_index.d,
+            f"IVF{vs_config['ivf_nlist']},PQ{vs_config['pq_m']}",
+            faiss.METRIC_L2
+        )
+        index.train(vectors)
+        index.add(vectors)
+        
+        return index
+    
+    def _measure_recall(self, index: faiss.Index, flat_index, n_queries: int = 100) -> float:
+        """저장된 벡터 일부를 질의로 사용해 Flat(정확 검색) 대비 recall@k 측정"""
+        k = self.config['rag']['top_k']
+        self._set_search_params(index)
+        
+        rng = np.random.default_rng(0)
+        ids = rng.choice(flat_index.ntotal, size=min(n_queries, flat_index.ntotal), replace=False)
+        queries = np.vstack([flat_index.reconstruct(int(i)) for i in ids])
+        
+        _, expected = flat_index.search(queries, k)
+        _, found = index.search(queries, k)
+        hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+        
+        return hits / expected.size
+    
+    def _set_search_params(self, index: faiss.Index):
+        """인덱스 종류별 검색 파라미터 설정"""
+        vs_config = self.config['vectorstore']
+        
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efSearch = vs_config['hnsw_ef_search']
+        else:
+            faiss.extract_index_ivf(index).nprobe = vs_config['ivf_nprobe']
+    
+    def _build_hnsw_index(self, flat_index) -> faiss.IndexHNSWFlat:
+        """Flat 인덱스의 벡터로 HNSW 인덱스 생성"""
+        vs_config = self.config['vectorstore']
+        
+        vectors = flat_index.reconstruct_n(0, flat_index.ntotal)
+        index = faiss.IndexHNSWFlat(flat_index.d, vs_config['hnsw_m'])
+        index.hnsw.efConstruction = vs_config['hnsw_ef_construction']
+        index.add(vectors)
+        
+        return index
+    
     def setup_qa_chain(self):
         """Q&A 체인 설정"""
         try:
-            llm = OpenAI(
+            llm = ChatOpenAI(
                 openai_api_key=os.getenv('OPENAI_API_KEY'),
-                model_name=self.config['model']['llm_model'],
+                model=self.config['model']['llm_model'],
                 temperature=0.1,
-                max_tokens=self.config['rag']['max_tokens']
+                max_tokens=self.config['rag']['max_tokens'],
+                streaming=True
             )
             
             self.qa_chain = RetrievalQA.from_chain_type(
@@ -127,38 +387,98 @@ class HospitalRAGSystem:
     
     def query(self, question: str) -> Dict[str, Any]:
         """질의응답 처리"""
+        if self.qa_chain is None:
+            return self._not_initialized_response()
+        
         try:
-            if self.qa_chain is None:
-                return {
-                    'answer': 'RAG 시스템이 초기화되지 않았습니다.',
-                    'source_documents': [],
-                    'confidence': 0.0
-                }
+            # 캐시 조회
+            cached = self.cache.lookup(question)
+            if cached['result'] is not None:
+                return cached['result']
+            
+            # 캐시 조회에서 만든 질문 임베딩으로 바로 검색 (질문당 임베딩 1회)
+            source_docs = self.vectorstore.similarity_search_by_vector(
+                cached['embedding'][0].tolist(),
+                k=self.config['rag']['top_k']
+            )
             
             # 질의 처리
-            result = self.qa_chain({"query": question})
+            output = self.qa_chain.combine_documents_chain.invoke(
+                {"input_documents": source_docs, "question": question}
+            )
+            result = {'result': output['output_text'], 'source_documents': source_docs}
             
-            # 결과 정리
-            answer = result['result']
-            source_docs = result['source_documents']
+            return self._build_response(question, result, cached['embedding'])
             
-            # 신뢰도 계산 (간단한 휴리스틱)
-            confidence = min(1.0, len(source_docs) / self.config['rag']['top_k'])
+        except Exception as e:
+            return self._error_response(question, e)
+    
+    async def aquery(self, question: str) -> Dict[str, Any]:
+        """비동기 질의응답 처리 (이벤트 루프를 직접 관리하는 호출자용)"""
+        if self.qa_chain is None:
+            return self._not_initialized_response()
+        
+        try:
+            # 캐시 조회 (임베딩 요청이 이벤트 루프를 막지 않도록 스레드에서 실행)
+            cached = await asyncio.to_thread(self.cache.lookup, question)
+            if cached['result'] is not None:
+                return cached['result']
             
-            return {
-                'answer': answer,
-                'source_documents': source_docs,
-                'confidence': confidence,
-                'question': question
-            }
+            # 캐시 조회에서 만든 질문 임베딩으로 바로 검색 (질문당 임베딩 1회)
+            source_docs = await self.vectorstore.asimilarity_search_by_vector(
+                cached['embedding'][0].tolist(),
+                k=self.config['rag']['top_k']
+            )
+            
+            # 질의 처리
+            output = await self.qa_chain.combine_documents_chain.ainvoke(
+                {"input_documents": source_docs, "question": question}
+            )
+            result = {'result': output['output_text'], 'source_documents': source_docs}
+            
+            return self._build_response(question, result, cached['embedding'])
             
         except Exception as e:
-            return {
-                'answer': f'질의 처리 중 오류가 발생했습니다: {str(e)}',
-                'source_documents': [],
-                'confidence': 0.0,
-                'question': question
-            }
+            return self._error_response(question, e)
+    
+    async def aquery_batch(self, questions: List[str]) -> List[Dict[str, Any]]:
+        """여러 질문을 동시에 처리 (배치 평가, 워밍업용)"""
+        return await asyncio.gather(*[self.aquery(question) for question in questions])
+    
+    def _build_response(self, question: str, result: Dict[str, Any], embedding) -> Dict[str, Any]:
+        """체인 결과를 응답 형식으로 정리하고 캐시에 저장"""
+        answer = result['result']
+        source_docs = result['source_documents']
+        
+        # 신뢰도 계산 (간단한 휴리스틱)
+        confidence = min(1.0, len(source_docs) / self.config['rag']['top_k'])
+        
+        response = {
+            'answer': answer,
+            'source_documents': source_docs,
+            'confidence': confidence,
+            'question': question
+        }
+        self.cache.add(question, response, embedding)
+        
+        return response
+    
+    def _not_initialized_response(self) -> Dict[str, Any]:
+        """시스템 미초기화 응답"""
+        return {
+            'answer': 'RAG 시스템이 초기화되지 않았습니다.',
+            'source_documents': [],
+            'confidence': 0.0
+        }
+    
+    def _error_response(self, question: str, error: Exception) -> Dict[str, Any]:
+        """질의 처리 오류 응답"""
+        return {
+            'answer': f'질의 처리 중 오류가 발생했습니다: {str(error)}',
+            'source_documents': [],
+            'confidence': 0.0,
+            'question': question
+        }
     
     def initialize_system(self):
         """전체 시스템 초기화"""
@@ -166,11 +486,12 @@ class HospitalRAGSystem:
         
         # 1. 임베딩 설정
         self.setup_embeddings()
+        self.setup_cache()
         
         # 2. 데이터 로드
-        train_qa_pairs = self.load_qa_data("data/processed/train_qa_pairs.pkl")
+        train_qa_pairs = self.load_qa_data("data/processed/train_qa_pairs.parquet")
         
-        if not train_qa_pairs:
+        if train_qa_pairs.empty:
             print("❌ 훈련 데이터를 찾을 수 없습니다.")
             return False
         
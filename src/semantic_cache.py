@@ -0,0 +1,78 @@
+"""
+질문 유사도 기반 응답 캐시 모듈
+"""
+import threading
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+import faiss
+
+class SemanticCache:
+    """동일/유사 질문에 대한 응답 캐시 클래스
+
+    1단계: 질문 문자열 완전 일치 (dict)
+    2단계: 질문 임베딩 코사인 유사도 (FAISS IndexFlatIP)
+    """
+
+    def __init__(self, embed_fn: Callable[[str], List[float]], threshold: float = 0.95):
+        """캐시 초기화"""
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+
+        self.exact_cache: Dict[str, Dict[str, Any]] = {}
+        self.index = None
+        self.entries: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def _normalize(self, embedding: List[float]) -> np.ndarray:
+        """내적이 코사인 유사도가 되도록 L2 정규화"""
+        vector = np.array([embedding], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def lookup(self, question: str) -> Dict[str, Any]:
+        """캐시 조회
+
+        반환값의 'result'는 캐시 적중 시 응답, 미적중 시 None 이며
+        'embedding'은 미적중 시 add()에 그대로 넘겨 재임베딩을 피합니다.
+        """
+        key = question.strip()
+
+        with self._lock:
+            if key in self.exact_cache:
+                return {'result': self._hit(self.exact_cache[key], question), 'embedding': None}
+
+        embedding = self._normalize(self.embed_fn(key))
+
+        with self._lock:
+            if self.index is not None and self.index.ntotal > 0:
+                scores, ids = self.index.search(embedding, 1)
+                if scores[0][0] >= self.threshold:
+                    return {'result': self._hit(self.entries[ids[0][0]], question), 'embedding': embedding}
+
+        return {'result': None, 'embedding': embedding}
+
+    def add(self, question: str, result: Dict[str, Any], embedding: Optional[np.ndarray] = None):
+        """응답 캐시 저장"""
+        key = question.strip()
+        if embedding is None:
+            embedding = self._normalize(self.embed_fn(key))
+
+        entry = {
+            'answer': result['answer'],
+            'confidence': result['confidence'],
+            'source_documents': result['source_documents']
+        }
+
+        with self._lock:
+            if key in self.exact_cache:
+                return
+            if self.index is None:
+                self.index = faiss.IndexFlatIP(embedding.shape[1])
+
+            self.exact_cache[key] = entry
+            self.index.add(embedding)
+            self.entries.append(entry)
+
+    def _hit(self, entry: Dict[str, Any], question: str) -> Dict[str, Any]:
+        """캐시 항목을 query() 결과 형식으로 변환"""
+        return {**entry, 'question': question}